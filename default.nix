@@ -8,8 +8,10 @@
   setuptools,
   stravalib,
   stravaweblib,
-  thefuzz,
+  rapidfuzz,
   pillow,
+  requests,
+  numpy,
 }:
 buildPythonPackage rec {
   pname = "strava2garminconnect";
@@ -26,8 +28,10 @@ buildPythonPackage rec {
     stravalib
     stravaweblib
     garminconnect
-    thefuzz
+    rapidfuzz
     pillow
+    requests
+    numpy
   ];
 
   meta = {
@@ -5,6 +5,7 @@ import io
 import logging
 import os
 import time
+from typing import BinaryIO
 from requests import HTTPError
 from urllib import request
 
@@ -53,7 +54,7 @@ class DuplicateActivityError(Exception):
 
 class Client(GarminClient):
 
-    def __init__(self, tokens: str, email: str, password: str, get_mfa):
+    def __init__(self, tokens: os.PathLike, email: str, password: str, get_mfa):
         tokens = os.path.join(tokens, "garmin")
 
         try:
@@ -67,9 +68,12 @@ class Client(GarminClient):
             self.login()
             self.garth.dump(tokens)
 
-    def upload_activity(self, name: str, content: bytes):
+    def upload_activity(self, name: str, content: bytes | BinaryIO):
+        if isinstance(content, (bytes, bytearray)):
+            content = io.BytesIO(content)
+
         files = {
-            "file": ("upload.fit", io.BytesIO(content)),
+            "file": ("upload.fit", content),
         }
 
         try:
@@ -131,7 +135,15 @@ class Client(GarminClient):
             if "content" not in existing_photo:
                 resp = request.urlopen(existing_photo["url"])
                 existing_photo["content"] = resp.read()
+                existing_photo["digest"] = image.digest(existing_photo["content"])
+
+        # Byte-identical photos are detected without decoding them
+        existing_digests = {p["digest"]: p for p in existing_photos}
+        digest = image.digest(content)
+        if digest in existing_digests:
+            raise DuplicateActivityPhoto(existing_digests[digest])
 
+        for existing_photo in existing_photos:
             existing_content = existing_photo["content"]
 
             if image.is_equal_bytes(existing_content, content, 5):
@@ -2,14 +2,16 @@
 # SPDX-License-Identifier: MIT
 
 import io
+import hashlib
+import numpy as np
 from PIL import Image
 from PIL import ImageChops
 
 """
   === imagecompare ===
 
-  This little tool compares two images using pillow's ImageChops and then converts the differnce to
-  black/white and sums up all found differences by summing up the histogram values of the difference
+  This little tool compares two images using numpy, reduces the per-channel difference of each pixel
+  to black/white by taking the channel maximum and sums up all found differences of the difference
   pixels.
 
   Taking the difference between a black and a white image of the same size as base a percentage value
@@ -39,6 +41,10 @@ from PIL import ImageChops
 """
 
 
+# Size to which large images are scaled down before comparing them with a tolerance
+THUMBNAIL_SIZE = 256
+
+
 class ImageCompareException(Exception):
     """
     Custom Exception class for imagecompare's exceptions.
@@ -46,13 +52,46 @@ class ImageCompareException(Exception):
     pass
 
 
-def pixel_diff(image_a, image_b):
+def _to_array(image):
     """
-    Calculates a black/white image containing all differences between the two input images.
+    Converts an image to an array with a single copy of its pixel buffer.
+
+    :param image: input image
+    :return: an array of shape (height, width, bands), or (height, width) for single band images
+    """
+    bands = len(image.getbands())
+    if bands == 1:
+        return np.asarray(image)
+
+    width, height = image.size
+    return np.frombuffer(image.tobytes(), dtype=np.uint8).reshape((height, width, bands))
+
+
+def _downsample(image, max_size):
+    """
+    Scales an image down to fit into a square while keeping its aspect ratio.
+
+    :param image: input image
+    :param max_size: the maximum width and height of the returned image
+    :return: the scaled image, or the input image if it already fits
+    """
+    width, height = image.size
+    if max(width, height) <= max_size:
+        return image
+
+    scale = max_size / max(width, height)
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+
+    return image.resize(size, Image.Resampling.BILINEAR)
+
+
+def _channel_max_diff(image_a, image_b):
+    """
+    Calculates the maximum absolute difference over all channels of each pixel.
 
     :param image_a: input image A
     :param image_b: input image B
-    :return: a black/white image containing the differences between A and B
+    :return: an int16 array of shape (height, width) containing the differences between A and B
     """
 
     if image_a.size != image_b.size:
@@ -65,41 +104,89 @@ def pixel_diff(image_a, image_b):
             "Different image mode, can only compare same mode images: A=" + str(image_a.mode) + " B=" + str(
                 image_b.mode))
 
-    diff = ImageChops.difference(image_a, image_b)
-    diff = diff.convert('L')
+    a = _to_array(image_a)
+    b = _to_array(image_b)
+
+    # subtract and take the absolute value in place on a single int16 buffer
+    diff = np.subtract(a, b, dtype=np.int16)
+    np.abs(diff, out=diff)
+    if diff.ndim == 3:
+        diff = diff.max(axis=-1)
 
     return diff
 
 
+def pixel_diff(image_a, image_b):
+    """
+    Calculates a black/white image containing all differences between the two input images.
+
+    The difference of a pixel is the maximum absolute difference over all of its channels
+    (not the luma-weighted grayscale value as returned by pillow's convert('L')).
+
+    :param image_a: input image A
+    :param image_b: input image B
+    :return: a black/white image as uint8 array containing the differences between A and B
+    """
+    return _channel_max_diff(image_a, image_b).astype(np.uint8)
+
+
 def total_histogram_diff(pixel_diff):
     """
     Sums up all histogram values of an image. When used with the black/white pixel-diff image
     this gives the difference "score" of an image.
 
-    :param pixel_diff: the black/white image containing all differences (output of imagecompare.pixel_diff function)
+    The histogram itself is never built: weighting each bin by its value and summing them up
+    equals the plain sum of all pixel values, which numpy reduces in a single pass.
+
+    :param pixel_diff: the black/white image or array containing all differences (output of imagecompare.pixel_diff function)
     :return: the total "score" of histogram values (histogram values of found differences)
     """
-    return sum(i * n for i, n in enumerate(pixel_diff.histogram()))
+    return int(np.sum(pixel_diff, dtype=np.uint64))
 
 
 def image_diff(image_a, image_b):
     """
     Calculates the total difference "score" of two images. (see imagecompare.total_histogram_diff).
 
+    The score is summed up directly from the channel differences without materializing the
+    black/white image of imagecompare.pixel_diff. Its maximum is still 255 per pixel.
+
     :param image_a: input image A
     :param image_b: input image A
     :return: the total difference "score" between two images
     """
-    histogram_diff = total_histogram_diff(pixel_diff(image_a, image_b))
+    return int(_channel_max_diff(image_a, image_b).sum(dtype=np.uint64))
+
+
+def digest(image_bytes):
+    """
+    Calculates a digest of an encoded image for detecting byte-identical images without decoding them.
 
-    return histogram_diff
+    :param image_bytes: the encoded image
+    :return: the digest of the image bytes
+    """
+    return hashlib.blake2b(image_bytes, digest_size=16).digest()
 
 
 def is_equal_bytes(image_a_bytes, image_b_bytes, tolerance=0.0):
-    image_a = Image.open(io.BytesIO(image_a_bytes))
-    image_b = Image.open(io.BytesIO(image_b_bytes))
+    # comparing the bytes checks the length first and stops at the first difference
+    if image_a_bytes == image_b_bytes:
+        return True
+
+    # Image.open() only parses the headers, so the sizes are known before decoding any pixels
+    with Image.open(io.BytesIO(image_a_bytes)) as image_a, Image.open(io.BytesIO(image_b_bytes)) as image_b:
+        if image_a.size != image_b.size:
+            return False
+
+        # thumbnail() lets the decoder skip most of the work for JPEG images
+        if tolerance != 0.0:
+            image_a.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE), Image.Resampling.BILINEAR)
+            image_b.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE), Image.Resampling.BILINEAR)
 
-    return is_equal(image_a, image_b, tolerance)
+        image_a.load()
+        image_b.load()
+
+        return is_equal(image_a, image_b, tolerance)
 
 def is_equal(image_a, image_b, tolerance=0.0):
     """
@@ -115,15 +202,20 @@ def is_equal(image_a, image_b, tolerance=0.0):
     if image_a.size != image_b.size:
         return False
 
+    # without tolerance a bounding box of the difference suffices
+    if tolerance == 0.0 and image_a.mode == image_b.mode:
+        return ImageChops.difference(image_a, image_b).getbbox(alpha_only=False) is None
+
     return image_diff_percent(image_a, image_b) <= tolerance
 
 
-def image_diff_percent(image_a, image_b):
+def image_diff_percent(image_a, image_b, downsample=THUMBNAIL_SIZE):
     """
     Calculate the difference between two images in percent.
 
     :param image_a: input image A
     :param image_b: input image B
+    :param downsample: scale both images down to fit into a square of this size before comparing them (None disables it)
     :return: the difference between the images A and B as percentage
     """
 
@@ -142,16 +234,21 @@ def image_diff_percent(image_a, image_b):
         close_b = True
 
     try:
-        # first determine difference of input images
-        input_images_histogram_diff = image_diff(image_a, image_b)
+        # the difference of large images hardly changes when comparing them scaled down
+        if downsample is not None and image_a.size == image_b.size:
+            diff_a = _downsample(image_a, downsample)
+            diff_b = _downsample(image_b, downsample)
+        else:
+            diff_a = image_a
+            diff_b = image_b
 
-        # to get the worst possible difference use a black and a white image
-        # of the same size and diff them
-
-        black_reference_image = Image.new('RGB', image_a.size, (0, 0, 0))
-        white_reference_image = Image.new('RGB', image_a.size, (255, 255, 255))
+        # first determine difference of input images
+        input_images_histogram_diff = image_diff(diff_a, diff_b)
 
-        worst_bw_diff = image_diff(black_reference_image, white_reference_image)
+        # the worst possible difference is the one between a black and a white
+        # image of the same size: every pixel of the diff image is 255
+        width, height = diff_a.size
+        worst_bw_diff = 255 * width * height
 
         percentage_histogram_diff = (input_images_histogram_diff / float(worst_bw_diff)) * 100
     finally:
@@ -1,18 +1,44 @@
 # SPDX-FileCopyrightText: 2024 Steffen Vogel <post@steffenvogel.de>
 # SPDX-License-Identifier: Apache-2.0
 
+import io
 import os
 import logging
+import functools
+import itertools
 import argparse
+import pathlib
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from urllib import request
 
+import requests
+from requests.adapters import HTTPAdapter
 from strava2garminconnect import garmin, strava, image
-from thefuzz import process
+from rapidfuzz import process, utils
 from stravaweblib import DataFormat
 
+_log = logging.getLogger(__name__)
+
+# Loggers of dependencies which are too verbose at debug level
+QUIET_LOGGERS = [
+    "oauthlib",
+    "requests_oauthlib",
+    "stravalib.util.limiter",
+    "urllib3.connectionpool",
+    "PIL",
+    "stravalib.client.BatchedResultsIterator",
+]
+
+# Reuse connections to Strava's CDN across photo downloads
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
+# Connect and read timeouts in seconds for photo downloads
+PHOTO_TIMEOUT = (5, 30)
+
+
 def get_code(url: str) -> str:
-    logging.info("Visit URL and extract code: %s", url)
+    _log.info("Visit URL and extract code: %s", url)
 
     return input("OAuth code: ")
 
@@ -21,13 +47,20 @@ def get_mfa() -> str:
     return input("MFA one-time code: ")
 
 
+def fetch_photo(url: str) -> bytes:
+    resp = SESSION.get(url, timeout=PHOTO_TIMEOUT)
+    resp.raise_for_status()
+
+    return resp.content
+
+
 def parse_args():
     parser = argparse.ArgumentParser()
 
     parser.add_argument(
         "--tokens",
-        type=str,
-        default=os.getenv("TOKENS", os.path.expanduser("~/.strava2garminconnect")),
+        type=pathlib.Path,
+        default=os.getenv("TOKENS", "~/.strava2garminconnect"),
         help="The path to a directory in which session tokens will be persisted"
     )
     parser.add_argument(
@@ -83,8 +116,8 @@ def parse_args():
         type=str,
         action="append",
         nargs="*",
-        default=os.environ.get("FILTER_ACTIVITY_TYPE"),
-        help="Filter the synchronized activities by type"
+        default=None,
+        help="Filter the synchronized activities by type (defaults to the comma-separated FILTER_ACTIVITY_TYPE)"
     )
     parser.add_argument(
         "--filter-last-days",
@@ -104,97 +137,116 @@ def parse_args():
 def read_secret(secret, secret_file):
     if secret_file is None:
         return secret
-    
-    with open(secret_file, "r") as file:
-        return file.read().strip()
+
+    return pathlib.Path(secret_file).read_text(encoding="utf-8").rstrip()
 
 
 def main():
     logging.basicConfig(level=logging.DEBUG)
 
-    for logger in ["oauthlib", "requests_oauthlib", "stravalib.util.limiter", "urllib3.connectionpool", "PIL", "stravalib.client.BatchedResultsIterator"]:
+    for logger in QUIET_LOGGERS:
         logging.getLogger(logger).setLevel(logging.INFO)
 
     args = parse_args()
 
+    # argparse collects a list per occurrence of --filter-activity-type
+    if args.filter_activity_type is None:
+        filter_activity_type = [os.environ.get("FILTER_ACTIVITY_TYPE", "").split(",")]
+    else:
+        filter_activity_type = args.filter_activity_type
+
+    filter_activity_types = frozenset(
+        t.strip() for t in itertools.chain.from_iterable(filter_activity_type) if t.strip()
+    )
+
     # Read secrets
     garmin_password = read_secret(args.garmin_password, args.garmin_password_file)
     strava_password = read_secret(args.strava_password, args.strava_password_file)
     strava_client_secret = read_secret(args.strava_client_secret, args.strava_client_secret_file)
 
+    tokens = args.tokens.expanduser().resolve()
+
     sc = strava.Client(
-        args.tokens,
+        tokens,
         args.strava_email,
         strava_password,
         args.strava_client_id,
         strava_client_secret,
         get_code,
     )
-    gc = garmin.Client(args.tokens, args.garmin_email, garmin_password, get_mfa)
+    gc = garmin.Client(tokens, args.garmin_email, garmin_password, get_mfa)
 
     if args.sync_gear:
         profile = gc.get_user_profile()
         garmin_gear = gc.get_gear(profile["id"])
         garmin_gear = {g["uuid"]: g["customMakeModel"] for g in garmin_gear if g["gearStatusName"] == "active"}
 
-    start_date = datetime.now() - timedelta(days=args.filter_last_days)
+        # Strava API calls are rate limited, so each gear is fetched and matched only once
+        @functools.lru_cache(maxsize=None)
+        def match_gear(strava_gear_id: str) -> tuple[str, float]:
+            strava_gear = sc.get_gear(strava_gear_id)
+            strava_gear_name = f"{strava_gear.name} {strava_gear.brand_name} {strava_gear.model_name}"
+
+            _, points, garmin_gear_uuid = process.extractOne(strava_gear_name, garmin_gear, processor=utils.default_process)
+
+            return garmin_gear_uuid, points
+
     end_date = datetime.now()
+    start_date = end_date - timedelta(days=args.filter_last_days)
 
     for activity in sc.get_activities(after=start_date, before=end_date):
-        logging.info("========================================") # just an empty line
+        _log.info("========================================") # just an empty line
 
-        if activity.type.root not in args.filter_activity_type:
-            logging.debug("Skipping activity %s", activity.name)
+        if filter_activity_types and activity.type.root not in filter_activity_types:
+            _log.debug("Skipping activity %s", activity.name)
             continue
 
-        logging.info("Processing activity %s", activity.name)
+        _log.info("Processing activity %s", activity.name)
 
         name, contents = sc.get_activity_data(activity.id, fmt=DataFormat.ORIGINAL)
-        content = b"".join(contents)
+
+        content = io.BytesIO()
+        for chunk in contents:
+            content.write(chunk)
+        content.seek(0)
 
         try:
             activity_id = gc.upload_activity(name, content)
-            logging.info("Activity uploaded to Garmin Connect")
+            _log.info("Activity uploaded to Garmin Connect")
         except garmin.DuplicateActivityError as e:
-            logging.warning("Activity has already been uploaded to Garmin Connect with (id=%d)", e.activity_id)
+            _log.warning("Activity has already been uploaded to Garmin Connect with (id=%d)", e.activity_id)
             activity_id = e.activity_id
 
         if args.sync_name:
-            logging.info("Set activity name")
+            _log.info("Set activity name")
             gc.set_activity_name(activity_id, activity.name)
 
         if args.sync_gear:
-            strava_gear = sc.get_gear(activity.gear_id)
-            strava_gear_name = f"{strava_gear.name} {strava_gear.brand_name} {strava_gear.model_name}"
-
-            _, points, garmin_gear_uuid = process.extractOne(strava_gear_name, garmin_gear)
+            garmin_gear_uuid, points = match_gear(activity.gear_id)
             if points > args.sync_gear_threshold:
                 gc.set_activity_gear(activity_id, garmin_gear_uuid)
-                logging.info("Matched and updated gear for activity to %s (id=%s)", garmin_gear[garmin_gear_uuid], garmin_gear_uuid)
+                _log.info("Matched and updated gear for activity to %s (id=%s)", garmin_gear[garmin_gear_uuid], garmin_gear_uuid)
             else:
-                logging.warning("Could not find matching gear for %s (id=%s)", garmin_gear[garmin_gear_uuid], garmin_gear_uuid)
+                _log.warning("Could not find matching gear for %s (id=%s)", garmin_gear[garmin_gear_uuid], garmin_gear_uuid)
 
         if args.sync_photos:
-            existing_photos = []
+            strava_photo_urls = []
             for photo in sc.get_activity_photos(activity.id):
-                strava_photo_url = None
-                strava_photo_size = 0
-
                 # Find best quality
-                for size, url in photo.urls.items():
-                    if int(size) > strava_photo_size:
-                        strava_photo_url = url
-                        strava_photo_size = size
-
-                # Fetch photo
-                resp = request.urlopen(strava_photo_url)
-                content = resp.read()
-            
-                try:
-                    gc.upload_photo_check_duplicate(activity_id, content, existing_photos)
-                    logging.info("Uploaded photo %s", strava_photo_url)
-                except garmin.DuplicateActivityPhoto as e:
-                    logging.warning(str(e))
+                strava_photo_url = photo.urls[max(photo.urls, key=int)]
+
+                strava_photo_urls.append(strava_photo_url)
+
+            # Fetch photos concurrently while uploading them one after another
+            existing_photos = []
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                contents = executor.map(fetch_photo, strava_photo_urls)
+                for strava_photo_url, content in zip(strava_photo_urls, contents):
+                    try:
+                        gc.upload_photo_check_duplicate(activity_id, content, existing_photos)
+                        _log.info("Uploaded photo %s", strava_photo_url)
+                    except garmin.DuplicateActivityPhoto as e:
+                        _log.warning(str(e))
 
 
 if __name__ == "__main__":
@@ -15,7 +15,7 @@ from stravalib import Client as StravaClient
 class Client(StravaWebClient):
     def __init__(
         self,
-        tokens: str,
+        tokens: os.PathLike,
         email: str,
         password: str,
         client_id: str,